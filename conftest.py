@@ -0,0 +1,28 @@
+# Copyright (c) 2019 Brave Software
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Make the unittest-git-secrets.py test cases importable by pytest.
+
+The script name contains dashes so pytest cannot collect it directly; load it
+under an importable module name so test_git_secrets.py can re-export the test
+class. This allows sharding the suite across cores with pytest-xdist, e.g.:
+
+    pytest -n auto
+
+Each test instance creates its own tempfile.mkdtemp() repository, so workers
+do not collide.
+"""
+
+import importlib.util
+import pathlib
+import sys
+
+_SCRIPT = pathlib.Path(__file__).parent / 'unittest-git-secrets.py'
+
+_spec = importlib.util.spec_from_file_location('unittest_git_secrets', _SCRIPT)
+_module = importlib.util.module_from_spec(_spec)
+sys.modules['unittest_git_secrets'] = _module
+_spec.loader.exec_module(_module)
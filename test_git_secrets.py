@@ -0,0 +1,12 @@
+# Copyright (c) 2019 Brave Software
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Pytest entry point for the git-secrets pre-commit hook tests.
+
+See conftest.py for how the unittest-git-secrets.py script is loaded.
+"""
+
+from unittest_git_secrets import Test_01_GitPreCommitHook  # noqa: F401
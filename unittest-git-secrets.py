@@ -20,7 +20,7 @@ warn of prohibited patterns found in the commit. A succesful result will display
 display 'OK' on the last line.
 
 NOTE: You must have the following pre-reqs already configured:
-* Python 3.4 or above
+* Python 3.6 or above
 * The tool [git-secrets](https://github.com/awslabs/git-secrets) must be
   installed and configured to recognize AWS patterns
 * You must setup a Git pre-commit hook:
@@ -31,21 +31,48 @@ NOTE: You must have the following pre-reqs already configured:
 
 """
 
-import argparse
+import atexit
+import functools
 import logging
 import os
-import pathlib
 import random
-import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import unittest
 
-from argparse import RawTextHelpFormatter
+from argparse import ArgumentParser, RawTextHelpFormatter
 from string import ascii_uppercase, ascii_lowercase, digits
 
+_AWS_SECRET_CHARS = ascii_uppercase + ascii_lowercase + digits + '/+='
+_AWS_ACCESS_CHARS = ascii_uppercase + digits
+_RNG = random.SystemRandom()
+
+_removal_threads = []
+
+
+@atexit.register
+def _join_removal_threads():
+    """Wait for background repo deletions so we don't orphan directories."""
+    for thread in _removal_threads:
+        thread.join()
+
+
+@functools.lru_cache(maxsize=1)
+def _resolve_git_secrets():
+    """Locate the git-secrets executable, walking $PATH only once."""
+    git_secrets = 'git-secrets'
+    found = shutil.which(git_secrets)
+    if found is None:
+        logging.error("{} is not found in the path!".format(git_secrets))
+        exit(1)
+    if not os.access(found, os.X_OK):
+        logging.error("{} is not executable!".format(found))
+        exit(1)
+    return found
+
 
 class ForegroundColor():
     """Ascii colors used for messages."""
@@ -62,49 +89,46 @@ class TestAwsPatterns(object):
         self.debug = debug
 
     def create_repo(self, path):
-        p = pathlib.Path(path)
-        git_dir_path = p / '.git'
-        if os.path.isdir(git_dir_path):
-            logging.error("Git directory \'{}\' already exists! Exiting...".format(git_dir_path))
+        git_dir = os.path.join(path, '.git')
+        if os.path.isdir(git_dir):
+            logging.error("Git directory \'{}\' already exists! Exiting...".format(git_dir))
 
-        cmd = "git init {}".format(path)
-        logging.debug("Running command: \'{}\'".format(cmd))  # DEBUG
+        cmd = ['git', '-c', 'core.fsync=none', 'init', path]
+        logging.debug("Running command: %r", cmd)  # DEBUG
         try:
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-            logging.debug(output.decode('utf-8'))
-            self.disable_gpgsign(path)
-            if self.debug:
-                git_config_path = p / '.git' / 'config'
-                with open(git_config_path, 'r') as f:
-                    contents = f.read()
-                    logging.debug(".git/config file contents: \n{}".format(contents))
+            result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            logging.debug(result.stdout.decode('utf-8'))
+            # Persist the fsync opt-out: -c only covers the init process, so
+            # write it to .git/config where later add/commit calls (and any
+            # clone of this repo) pick it up.
+            cmd = ['git', '-C', path, 'config', 'core.fsync', 'none']
+            logging.debug("Running command: %r", cmd)  # DEBUG
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if self.debug and logging.getLogger().isEnabledFor(logging.DEBUG):
+                config = subprocess.run(['git', '-C', path, 'config', '--list', '--local'],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                logging.debug("Local git config: \n%s", config.stdout.decode('utf-8'))
         except subprocess.CalledProcessError as cpe:
             logging.error('Command \'{}\' return code: {}'.format(cmd, cpe.returncode))
             logging.error('Command output: {}'.format(cpe.output.decode('utf-8')))
             return False
 
-    def disable_gpgsign(self, path):
-        p = pathlib.Path(path)
-        git_config_path = p / '.git' / 'config'
-
-        gpgsign_config_string = '{}\n\t{}'.format('[commit]', 'gpgsign = false')
-
-        with open(git_config_path, 'a') as f:
-            f.write(gpgsign_config_string)
-
-    def trigger_hook(self, f):
+    def trigger_hook(self, path, f):
+        # Git must run as the real binary here: in-process git libraries
+        # (pygit2/libgit2, GitPython's index API) create commits without
+        # dispatching the pre-commit hook, which is the behavior under test.
         marker = False
-        cmd = 'git add {}'.format(f)
-        logging.debug("Running command: \'{}\'".format(cmd))  # DEBUG
+        cmd = ['git', '-C', path, 'add', f]
+        logging.debug("Running command: %r", cmd)  # DEBUG
         try:
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as cpe:
             logging.error("Could not run command \'{}\': {}".format(cmd, cpe.output.decode('utf-8')))
 
-        cmd = 'git commit -m \'{}\''.format("test pre-commit hook")
-        logging.debug("Running command: \'{}\'".format(cmd))  # DEBUG
+        cmd = ['git', '-C', path, '-c', 'commit.gpgsign=false', 'commit', '-am', 'test pre-commit hook']
+        logging.debug("Running command: %r", cmd)  # DEBUG
         try:
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             marker = True
         except subprocess.CalledProcessError as cpe:
             logging.info('Command \'{}\' return code: {}'.format(cmd, cpe.returncode))
@@ -113,40 +137,48 @@ class TestAwsPatterns(object):
 
         return marker
 
+    def copy_repo(self, src, dst):
+        # cp with --reflink=auto gives O(1) copy-on-write clones on Btrfs/XFS;
+        # fall back to a plain copy where cp lacks the flag (e.g. BSD cp on Mac).
+        cmd = ['cp', '-a', '--reflink=auto', src + '/.', dst]
+        logging.debug("Running command: %r", cmd)  # DEBUG
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(dst, ignore_errors=True)
+            shutil.copytree(src, dst)
+
     def remove_repo(self, path):
+        # Rename is atomic within the filesystem; the slow recursive delete
+        # then overlaps with the next test's setup instead of blocking it.
+        trash = '{}.trash-{}'.format(path, os.urandom(4).hex())
         try:
-            shutil.rmtree(path)
+            os.rename(path, trash)
         except Exception as e:
             logging.error("Cannot remove directory \'{}\': \'{}\'".format(path, e))
             return False
+        thread = threading.Thread(target=shutil.rmtree, args=(trash,),
+                                  kwargs={'ignore_errors': True}, daemon=True)
+        thread.start()
+        _removal_threads.append(thread)
 
     def generate_random_aws_secret_key(self):
-        chars = ascii_uppercase + ascii_lowercase + digits + '/' + '+' + '='
-        key = ''.join(random.choice(chars) for _ in range(40))
+        key = ''.join(_RNG.choices(_AWS_SECRET_CHARS, k=40))
         return key
 
     def generate_random_aws_access_key(self):
-        chars = ascii_uppercase + digits
-        key = 'AKIA' + ''.join(random.choice(chars) for _ in range(16))
+        key = 'AKIA' + ''.join(_RNG.choices(_AWS_ACCESS_CHARS, k=16))
         return key
 
     def which_git_secrets(self):
-        git_secrets = 'git-secrets'
-        found = shutil.which(git_secrets)
-        if found is None:
-            logging.error("{} is not found in the path!".format(git_secrets))
-            exit(1)
-        else:
-            if not os.access(found, os.X_OK):
-                logging.error("{} is not executable!".format(found))
-                exit(1)
+        return _resolve_git_secrets()
 
     def scan_git_secrets(self, path):
-        cmd = 'git-secrets --scan ' + path
-        logging.debug("Running command: \'{}\'".format(cmd))  # DEBUG
+        cmd = [_resolve_git_secrets(), '--scan', path]
+        logging.debug("Running command: %r", cmd)  # DEBUG
         try:
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-            logging.debug(output.decode('utf-8'))
+            result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            logging.debug(result.stdout.decode('utf-8'))
         except subprocess.CalledProcessError as cpe:
             logging.info('Command \'{}\' return code: {}'.format(cmd, cpe.returncode))
             logging.info('Command output: {}{}{}'.format(ForegroundColor.GREEN, cpe.output.decode('utf-8'),
@@ -159,37 +191,44 @@ class Test_01_GitPreCommitHook(unittest.TestCase):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.repo_path = tempfile.mkdtemp()
         self.outfile = 'test.txt'
-        self.debug = False
-        if self.DEBUG:
-            self.debug = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.g1 = TestAwsPatterns(cls.DEBUG)
+        # git init runs once into a template repo; each test clones it
+        # instead of re-initializing from scratch.
+        cls._template = tempfile.mkdtemp(
+            dir=os.environ.get('GIT_SECRETS_TMPDIR',
+                               '/dev/shm' if os.path.isdir('/dev/shm') else None))
+        cls.g1.create_repo(cls._template)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.g1.remove_repo(cls._template)
 
     def setUp(self):
-        self.g1 = TestAwsPatterns(self.debug)
-        self.g1.which_git_secrets()
-        if self.g1.create_repo(self.repo_path) is not False:
-            p = pathlib.Path(self.repo_path)
-            outfile_path = p / self.outfile
-            prohibited_pattern = 'aws_secret_access_key = {}'.format(self.g1.generate_random_aws_secret_key())
-            with open(outfile_path, 'w') as f:
-                f.write(prohibited_pattern)
+        # Prefer a RAM-backed filesystem for the throwaway repo so git's
+        # object writes never hit disk; honor an explicit override first.
+        # Created here rather than in __init__ so instances that are built
+        # but never run (e.g. during pytest collection) don't leak dirs.
+        self.repo_path = tempfile.mkdtemp(
+            dir=os.environ.get('GIT_SECRETS_TMPDIR',
+                               '/dev/shm' if os.path.isdir('/dev/shm') else None))
+        self.g1.copy_repo(self._template, self.repo_path)
+        outfile_path = os.path.join(self.repo_path, self.outfile)
+        prohibited_pattern = 'aws_secret_access_key = {}'.format(self.g1.generate_random_aws_secret_key())
+        fd = os.open(outfile_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(fd, prohibited_pattern.encode('ascii'))
+        os.close(fd)
+
+    def test_00_git_secrets_installed(self):
+        # Cheap environment check; runs first so a broken install fails the
+        # suite before the slower pre-commit hook exercise starts.
+        self.assertTrue(self.g1.which_git_secrets())
 
     def test_git_pre_commit_hook(self):
-        saved_path = os.getcwd()
-        try:
-            os.chdir(self.repo_path)
-            logging.debug('Changed directory to \"{}\"'.format(self.repo_path))
-        except OSError as ose:
-            message = ('Error: could not change directory to {}: {}'.format(self.repo_path, ose))
-            logging.error(message)
-        self.assertFalse(self.g1.trigger_hook(self.outfile))
-        try:
-            os.chdir(saved_path)
-            logging.debug('Changed directory to \"{}\"'.format(saved_path))
-        except OSError as ose:
-            message = ('Error: could not change directory to {}: {}'.format(saved_path, ose))
-            logging.error(message)
+        self.assertFalse(self.g1.trigger_hook(self.repo_path, self.outfile))
 
     def tearDown(self):
         if self.g1.remove_repo(self.repo_path) is False:
@@ -212,7 +251,7 @@ warn of prohibited patterns found in the commit. A succesful result will display
 display 'OK' on the last line.
 
 NOTE: You must have the following pre-reqs already configured:
-* Python 3.4 or above
+* Python 3.6 or above
 * The tool [git-secrets](https://github.com/awslabs/git-secrets) must be
   installed and configured to recognize AWS patterns
 * You must setup a Git pre-commit hook:
@@ -223,7 +262,7 @@ NOTE: You must have the following pre-reqs already configured:
 
 """
 
-    parser = argparse.ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter)
+    parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter)
     parser.add_argument('-d', '--debug', action='store_true', help='Print debug output')
     try:
         options = parser.parse_args()
@@ -234,10 +273,10 @@ NOTE: You must have the following pre-reqs already configured:
 
 def main():
 
-    # Pathlib is available as a stdlib function in Python 3.4, so we want to
-    # encourage upgrading to a recent version of Python in order to use this tool.
-    if not sys.version_info >= (3, 4):
-        print("ERROR: Required minimum Python version is 3.4! Exiting...")
+    # random.choices is available in Python 3.6, so we want to encourage
+    # upgrading to a recent version of Python in order to use this tool.
+    if not sys.version_info >= (3, 6):
+        print("ERROR: Required minimum Python version is 3.6! Exiting...")
         exit(1)
 
     args = parse_args()
@@ -248,7 +287,7 @@ def main():
     else:
         logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(message)s')
 
-    unittest.main()
+    unittest.main(failfast=True)
 
 
 if __name__ == '__main__':